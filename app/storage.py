@@ -1,11 +1,14 @@
 import asyncio
-import json
 import os
+import shutil
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 import aiofiles
-from pydantic import BaseModel, Field
+import aiosqlite
+import orjson
+from pydantic import BaseModel, Field, TypeAdapter
 
 class MetadataEntry(BaseModel):
     id: str
@@ -19,50 +22,191 @@ class MetadataEntry(BaseModel):
     artist: Optional[str] = None
     description: Optional[str] = None
 
+# Serializes a whole entry list in one pydantic-core (Rust) walk.
+_ENTRY_LIST_ADAPTER = TypeAdapter(List[MetadataEntry])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    tags TEXT,
+    file_size INTEGER,
+    upload_timestamp TEXT,
+    title TEXT,
+    artist TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_user ON files(user_id);
+"""
+
 class Storage:
-    def __init__(self, base_path: str = "./audio-data"):
+    # Chunk size for streaming uploads to disk.
+    UPLOAD_CHUNK_SIZE = 1 << 20
+
+    # How long to wait before committing metadata changes, so a burst of
+    # uploads/deletes shares a single transaction commit.
+    COMMIT_DELAY = 0.1
+
+    # Cap on cached serialized list payloads.
+    LIST_CACHE_MAX = 1024
+
+    def __init__(self, base_path: str = "./audio-data", db_path: Optional[str] = None):
         self.base_path = base_path
         self.uploads_path = os.path.join(self.base_path, "uploads")
         self.metadata_path = os.path.join(self.base_path, "metadata.json")
-        self._lock = asyncio.Lock()
+        # db_path may be ":memory:" for an in-memory metadata store.
+        self.db_path = db_path or os.path.join(self.base_path, "metadata.db")
+        self._db: Optional[aiosqlite.Connection] = None
+        # All entries by id, plus a per-user index so list/lookup never
+        # hit the database per request.
+        self._all: Dict[str, MetadataEntry] = {}
+        self._index: Dict[str, Dict[str, MetadataEntry]] = {}
+        # Inverted tag index per user, so tag-filtered lists touch only
+        # matching entries instead of scanning every tag list.
+        self._tag_index: Dict[str, Dict[str, Set[str]]] = {}
+        self._loaded = False
+        self._commit_task: Optional[asyncio.Task] = None
+        # Serialized /list payloads keyed by (user_id, tag, version); the
+        # per-user version bumps on any mutation, so stale bytes are never
+        # served.
+        self._version: Dict[str, int] = defaultdict(int)
+        self._list_cache: Dict[Tuple[str, Optional[str], int], Tuple[bytes, int]] = {}
+
+    async def initialize(self):
+        await self.ensure_metadata()
+
+    async def cleanup(self):
+        if self._commit_task is not None and not self._commit_task.done():
+            self._commit_task.cancel()
+        if self._db is not None:
+            await self._db.commit()
+            await self._db.close()
+            self._db = None
+        self._loaded = False
+
+    def _schedule_commit(self):
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._delayed_commit())
+
+    async def _delayed_commit(self):
+        await asyncio.sleep(self.COMMIT_DELAY)
+        if self._db is not None:
+            await self._db.commit()
 
     async def ensure_metadata(self):
         os.makedirs(self.uploads_path, exist_ok=True)
-        if not os.path.exists(self.metadata_path):
-            async with aiofiles.open(self.metadata_path, mode="w") as f:
-                await f.write(json.dumps({}))
+        self._db = await aiosqlite.connect(self.db_path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.executescript(_SCHEMA)
+        await self._migrate_legacy_json()
 
+        self._all = {}
+        self._index = {}
+        self._tag_index = {}
+        async with self._db.execute("SELECT * FROM files") as cursor:
+            async for row in cursor:
+                entry = self._row_to_entry(row)
+                self._all[entry.id] = entry
+                self._index.setdefault(entry.user_id, {})[entry.id] = entry
+                self._index_tags(entry)
+        self._loaded = True
 
-    async def _read_metadata(self) -> Dict[str, MetadataEntry]:
-        async with self._lock:
-            async with aiofiles.open(self.metadata_path, mode="r") as f:
-                content = await f.read()
+    async def _ensure_loaded(self):
+        if not self._loaded:
+            await self.ensure_metadata()
+
+    async def _migrate_legacy_json(self):
+        """Import entries from the old metadata.json store, if present."""
+        if not os.path.exists(self.metadata_path):
+            return
+        async with aiofiles.open(self.metadata_path, mode="rb") as f:
+            content = await f.read()
+        try:
+            raw = orjson.loads(content or b"{}")
+        except Exception:
+            raw = {}
+        for r in raw.values():
+            if isinstance(r.get('upload_timestamp'), str):
                 try:
-                    raw = json.loads(content or "{}")
-                except Exception:
-                    raw = {}
-
-                entries = {}
-                for entry_id, r in raw.items():
-                    if 'upload_timestamp' in r and isinstance(r['upload_timestamp'], str):
-                        try:
-                            r['upload_timestamp'] = datetime.fromisoformat(r['upload_timestamp'])
-                        except ValueError:
-                            r['upload_timestamp'] = datetime.now()
-                    entries[entry_id] = MetadataEntry(**r)
-                return entries
-
-
-    async def _write_metadata(self, items: Dict[str, MetadataEntry]):
-        async with self._lock:
-            async with aiofiles.open(self.metadata_path, mode="w") as f:
-                serializable_items = {}
-                for entry_id, item in items.items():
-                    item_dict = item.model_dump()
-                    if isinstance(item_dict.get('upload_timestamp'), datetime):
-                        item_dict['upload_timestamp'] = item_dict['upload_timestamp'].isoformat()
-                    serializable_items[entry_id] = item_dict
-                await f.write(json.dumps(serializable_items, indent=2, ensure_ascii=False))
+                    r['upload_timestamp'] = datetime.fromisoformat(r['upload_timestamp'])
+                except ValueError:
+                    r['upload_timestamp'] = datetime.now()
+            await self._persist_entry(MetadataEntry(**r))
+        await self._db.commit()
+        os.replace(self.metadata_path, self.metadata_path + ".bak")
+
+    @staticmethod
+    def _row_to_entry(row) -> MetadataEntry:
+        (entry_id, user_id, filename, content_type, tags, file_size,
+         upload_timestamp, title, artist, description) = row
+        # Rows come from our own table, so skip Pydantic validation;
+        # the timestamp is parsed explicitly since construct won't coerce.
+        return MetadataEntry.model_construct(
+            id=entry_id,
+            user_id=user_id,
+            filename=filename,
+            content_type=content_type,
+            tags=orjson.loads(tags) if tags else None,
+            file_size=file_size,
+            upload_timestamp=datetime.fromisoformat(upload_timestamp),
+            title=title,
+            artist=artist,
+            description=description,
+        )
+
+    async def _persist_entry(self, entry: MetadataEntry) -> None:
+        await self._db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                entry.id,
+                entry.user_id,
+                entry.filename,
+                entry.content_type,
+                orjson.dumps(entry.tags).decode() if entry.tags is not None else None,
+                entry.file_size,
+                entry.upload_timestamp.isoformat(),
+                entry.title,
+                entry.artist,
+                entry.description,
+            ),
+        )
+
+
+    def _index_tags(self, entry: MetadataEntry) -> None:
+        for t in entry.tags or []:
+            self._tag_index.setdefault(entry.user_id, {}).setdefault(t, set()).add(entry.id)
+
+    def _unindex_tags(self, entry: MetadataEntry) -> None:
+        user_tags = self._tag_index.get(entry.user_id, {})
+        for t in entry.tags or []:
+            ids = user_tags.get(t)
+            if ids is not None:
+                ids.discard(entry.id)
+                if not ids:
+                    del user_tags[t]
+
+    @staticmethod
+    def _copy_fileobj(src, path: str) -> int:
+        with open(path, "wb") as out_f:
+            # Large uploads roll the SpooledTemporaryFile over to a real
+            # file; copy those in-kernel with sendfile instead of looping
+            # read/write buffers through Python. Small in-memory spools
+            # stay on copyfileobj (fileno() would force a rollover).
+            if getattr(src, "_rolled", False) and hasattr(os, "sendfile"):
+                src.flush()
+                offset = 0
+                while True:
+                    sent = os.sendfile(
+                        out_f.fileno(), src.fileno(), offset, Storage.UPLOAD_CHUNK_SIZE
+                    )
+                    if sent == 0:
+                        return offset
+                    offset += sent
+            shutil.copyfileobj(src, out_f, Storage.UPLOAD_CHUNK_SIZE)
+            return out_f.tell()
 
 
     def _user_folder(self, user_id: str) -> str:
@@ -71,43 +215,102 @@ class Storage:
         return path
 
 
-    async def save_upload(self, entry: MetadataEntry, file_content: bytes) -> None:
+    async def save_upload(self, entry: MetadataEntry, file) -> None:
+        """Stream an upload to disk in chunks and record its metadata.
+
+        ``file`` is anything with an async ``read(size)`` method (such as
+        fastapi's UploadFile); ``entry.file_size`` is set from the bytes
+        actually written.
+        """
+        await self._ensure_loaded()
         user_folder = self._user_folder(entry.user_id)
         # Use UUID for filename to prevent path traversal attacks
         file_extension = os.path.splitext(entry.filename)[1] if entry.filename else ""
         safe_filename = f"{entry.id}{file_extension}"
         path = os.path.join(user_folder, safe_filename)
 
-        async with aiofiles.open(path, mode="wb") as out_f:
-            await out_f.write(file_content)
+        # Write to a temp name and rename into place, so a crash mid-copy
+        # never leaves a truncated file at the final path.
+        tmp_path = path + ".tmp"
+        sync_file = getattr(file, "file", None)
+        if sync_file is not None:
+            # UploadFile wraps a SpooledTemporaryFile; copying it in a single
+            # worker-thread call avoids the two threadpool hops aiofiles
+            # would pay per chunk.
+            total = await asyncio.to_thread(self._copy_fileobj, sync_file, tmp_path)
+        else:
+            total = 0
+            async with aiofiles.open(tmp_path, mode="wb") as out_f:
+                while chunk := await file.read(self.UPLOAD_CHUNK_SIZE):
+                    await out_f.write(chunk)
+                    total += len(chunk)
+        os.replace(tmp_path, path)
+        entry.file_size = total
 
-        items = await self._read_metadata()
-        items[entry.id] = entry
-        await self._write_metadata(items)
+        old = self._all.get(entry.id)
+        if old is not None:
+            self._unindex_tags(old)
+        self._all[entry.id] = entry
+        self._index.setdefault(entry.user_id, {})[entry.id] = entry
+        self._index_tags(entry)
+        self._version[entry.user_id] += 1
+        await self._persist_entry(entry)
+        self._schedule_commit()
 
 
     async def list_user_uploads(self, user_id: str, tag: Optional[str] = None) -> List[MetadataEntry]:
-        items = await self._read_metadata()
-        filtered = [i for i in items.values() if i.user_id == user_id]
+        await self._ensure_loaded()
+        entries = self._index.get(user_id, {})
         if tag:
-            filtered = [i for i in filtered if tag in (i.tags or [])]
-        return filtered
+            ids = self._tag_index.get(user_id, {}).get(tag, ())
+            return [entries[i] for i in ids if i in entries]
+        return list(entries.values())
+
+
+    async def list_payload(self, user_id: str, tag: Optional[str] = None) -> Tuple[bytes, int]:
+        """Return (serialized items array, count) for a user's uploads.
+
+        Payload bytes are cached until the user's uploads change, so a
+        repeated /list is a dict lookup instead of a full serialization.
+        """
+        await self._ensure_loaded()
+        key = (user_id, tag, self._version[user_id])
+        cached = self._list_cache.get(key)
+        if cached is None:
+            entries = await self.list_user_uploads(user_id=user_id, tag=tag)
+            if len(self._list_cache) >= self.LIST_CACHE_MAX:
+                self._list_cache.clear()
+            # exclude_none drops unset optional fields (title/artist/...)
+            # from the wire format instead of emitting nulls.
+            cached = (_ENTRY_LIST_ADAPTER.dump_json(entries, exclude_none=True), len(entries))
+            self._list_cache[key] = cached
+        return cached
+
+
+    async def get_entry(self, user_id: str, file_id: str) -> Optional[MetadataEntry]:
+        """Direct index lookup of a single entry, without scanning."""
+        await self._ensure_loaded()
+        return self._index.get(user_id, {}).get(file_id)
 
 
     def get_user_file_path(self, entry: MetadataEntry) -> str:
-        user_folder = self._user_folder(entry.user_id)
+        """Pure path computation; only save_upload creates the folder."""
         file_extension = os.path.splitext(entry.filename)[1] if entry.filename else ""
         safe_filename = f"{entry.id}{file_extension}"
-        return os.path.join(user_folder, safe_filename)
+        return os.path.join(self.uploads_path, entry.user_id, safe_filename)
 
     async def delete_upload(self, entry: MetadataEntry) -> None:
         """Delete a file and remove from metadata."""
-        # Delete physical file
-        file_path = self.get_user_file_path(entry)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            
-        items = await self._read_metadata()
-        if entry.id in items:
-            del items[entry.id]
-        await self._write_metadata(items)
\ No newline at end of file
+        await self._ensure_loaded()
+        # Delete physical file; one syscall instead of exists()+remove().
+        try:
+            os.remove(self.get_user_file_path(entry))
+        except FileNotFoundError:
+            pass
+
+        self._all.pop(entry.id, None)
+        self._index.get(entry.user_id, {}).pop(entry.id, None)
+        self._unindex_tags(entry)
+        self._version[entry.user_id] += 1
+        await self._db.execute("DELETE FROM files WHERE id = ?", (entry.id,))
+        self._schedule_commit()
@@ -0,0 +1,20 @@
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+
+import app.main
+from app.main import app as fastapi_app
+from app.storage import Storage
+
+
+@pytest_asyncio.fixture(scope="session")
+async def client(tmp_path_factory):
+    """One app lifespan and one AsyncClient shared by the whole session.
+
+    Avoids TestClient's per-request sync-over-async bridge and repeated
+    lifespan startup/shutdown per test.
+    """
+    app.main.storage = Storage(base_path=str(tmp_path_factory.mktemp("audio-data")))
+    async with fastapi_app.router.lifespan_context(fastapi_app):
+        transport = ASGITransport(app=fastapi_app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            yield c
@@ -1,99 +1,230 @@
+import asyncio
 import io
-import pytest
-from fastapi.testclient import TestClient
-from unittest.mock import patch, AsyncMock
-from app.main import app
+import sys
+from types import MappingProxyType
+from unittest.mock import AsyncMock, MagicMock
 
-client = TestClient(app)
+import httpx
+import orjson
+import pytest
+import pytest_asyncio
+
+import app.main as app_main
+from app.main import app, get_storage
+from app.storage import Storage
+
+# Shared payloads, built once at import time and frozen; tests only read
+# them. Interning the user id gives dict lookups the pointer-equality
+# fast path.
+TEST_USER_ID = sys.intern("test_user")
+TEST_AUDIO_CONTENT = b"test audio content"
+UPLOAD_FILES = MappingProxyType({"audio": ("test.mp3", TEST_AUDIO_CONTENT, "audio/mpeg")})
+UPLOAD_FORM = MappingProxyType({
+    "user_id": TEST_USER_ID,
+    "tags": "tag1,tag2",
+    "title": "Test Song",
+    "artist": "Test Artist",
+    "description": "Test Description",
+})
+
+# Hot URLs parsed and query-encoded once instead of per request.
+USER_PARAMS = MappingProxyType({"user_id": TEST_USER_ID})
+LIST_URL = httpx.URL("/list", params=USER_PARAMS)
+DOWNLOAD_URL = httpx.URL("/download", params=USER_PARAMS)
+
+def _file_url(file_id, suffix=""):
+    return httpx.URL(f"/files/{file_id}{suffix}", params=USER_PARAMS)
 
 @pytest.fixture
 def mock_storage():
-    with patch('app.main.storage') as mock:
-        mock.list_user_uploads = AsyncMock()
-        mock.store_file = AsyncMock()
-        mock.delete_file = AsyncMock()
-        mock.get_user_file_path = AsyncMock()
-        yield mock
-
-def test_health_check():
-    response = client.get("/health")
-    assert response.status_code == 200
-    assert response.json() == {"status": "ok"}
-
-def test_list_uploads_no_userid():
-    response = client.get("/list")
-    assert response.status_code == 422
-
-def test_list_uploads_empty(mock_storage):
-    mock_storage.list_user_uploads.return_value = []
-    response = client.get("/list?user_id=test_user")
+    mock = MagicMock()
+    mock.list_user_uploads = AsyncMock()
+    mock.list_payload = AsyncMock()
+    mock.get_entry = AsyncMock()
+    mock.store_file = AsyncMock()
+    mock.delete_file = AsyncMock()
+    mock.get_user_file_path = AsyncMock()
+    app.dependency_overrides[get_storage] = lambda: mock
+    yield mock
+    app.dependency_overrides.pop(get_storage, None)
+
+@pytest_asyncio.fixture
+async def temp_storage(tmp_path):
+    """Real Storage with an in-memory metadata store, isolated per test."""
+    storage = Storage(base_path=str(tmp_path), db_path=":memory:")
+    app.dependency_overrides[get_storage] = lambda: storage
+    yield storage
+    await storage.cleanup()
+    app.dependency_overrides.pop(get_storage, None)
+
+@pytest.mark.parametrize("method,url,expected", [
+    ("GET", "/health", 200),
+    ("GET", "/list", 422),
+    ("GET", "/download", 422),
+    ("GET", "/files/some-id", 422),
+    ("GET", "/files/some-id/info", 422),
+    ("DELETE", "/files/some-id", 422),
+])
+async def test_endpoint_status(client, method, url, expected):
+    response = await client.request(method, url)
+    assert response.status_code == expected
+    if url == "/health":
+        assert response.json() == {"status": "ok"}
+
+async def test_missing_userid_concurrent(client):
+    # One loop pass dispatches all the smoke requests concurrently.
+    responses = await asyncio.gather(
+        *[client.get(url) for url in ("/list", "/download", "/files/x/info")]
+    )
+    assert all(r.status_code == 422 for r in responses)
+
+async def test_list_uploads_empty(client, mock_storage):
+    mock_storage.list_payload.return_value = (b"[]", 0)
+    response = await client.get(LIST_URL)
     assert response.status_code == 200
     data = response.json()
     assert data["user_id"] == "test_user"
     assert data["count"] == 0
     assert data["items"] == []
 
-def test_upload_no_userid():
-    response = client.post("/upload", data={})
+async def test_upload_no_userid(client):
+    response = await client.post("/upload", data={})
     assert response.status_code == 422
 
-def test_upload_no_file():
-    response = client.post("/upload", data={"user_id": "test_user"})
+async def test_upload_no_file(client):
+    response = await client.post("/upload", data={"user_id": "test_user"})
     assert response.status_code == 422
 
-def test_upload_success(mock_storage):
+async def test_upload_success(client, mock_storage):
     mock_storage.store_file.return_value = "test-id-1"
     mock_storage.save_upload = AsyncMock()
     mock_storage.metadata_path = "/mock/metadata/path"
 
-    test_file = io.BytesIO(b"test audio content")
-    files = {"audio": ("test.mp3", test_file, "audio/mp3")}
-    data = {
-        "user_id": "test_user",
-        "tags": "tag1,tag2",
-        "title": "Test Song",
-        "artist": "Test Artist",
-        "description": "Test Description"
-    }
-    response = client.post("/upload", data=data, files=files)
+    response = await client.post("/upload", data=UPLOAD_FORM, files=UPLOAD_FILES)
     assert response.status_code == 200
-    assert "id" in response.json()
-    assert response.json()["status"] == "ok"
+    body = response.json()
+    assert "id" in body
+    assert body["status"] == "ok"
 
 
-def test_download_no_userid():
-    response = client.get("/download")
-    assert response.status_code == 422
-
-def test_download_nonexistent_user(mock_storage):
+async def test_download_nonexistent_user(client, mock_storage):
     mock_storage.list_user_uploads.return_value = []
     mock_storage.get_user_file_path.side_effect = FileNotFoundError
-    response = client.get("/download?user_id=nonexistent")
+    response = await client.get("/download?user_id=nonexistent")
     assert response.status_code == 404
+    # Exact match on the short fixed message; no substring scan.
+    assert response.json()["detail"] == "no uploads found"
 
-def test_get_file_no_userid():
-    response = client.get("/files/some-id")
-    assert response.status_code == 422
-
-def test_get_file_not_found(mock_storage):
-    mock_storage.list_user_uploads.return_value = []
-    response = client.get("/files/nonexistent-id?user_id=test_user")
+async def test_get_file_not_found(client, mock_storage):
+    mock_storage.get_entry.return_value = None
+    response = await client.get(_file_url("nonexistent-id"))
     assert response.status_code == 404
 
-def test_delete_file_no_userid():
-    response = client.delete("/files/some-id")
-    assert response.status_code == 422
+async def test_delete_file_not_found(client, mock_storage):
+    mock_storage.get_entry.return_value = None
+    response = await client.delete(_file_url("nonexistent-id"))
+    assert response.status_code == 404
 
-def test_delete_file_not_found(mock_storage):
-    mock_storage.list_user_uploads.return_value = []
-    response = client.delete("/files/nonexistent-id?user_id=test_user")
+async def test_file_info_not_found(client, mock_storage):
+    mock_storage.get_entry.return_value = None
+    response = await client.get(_file_url("nonexistent-id", "/info"))
     assert response.status_code == 404
 
-def test_file_info_no_userid():
-    response = client.get("/files/some-id/info")
-    assert response.status_code == 422
 
-def test_file_info_not_found(mock_storage):
-    mock_storage.list_user_uploads.return_value = []
-    response = client.get("/files/nonexistent-id/info?user_id=test_user")
-    assert response.status_code == 404
\ No newline at end of file
+# Encode the multipart body once; every upload in the suite posts the
+# same payload, so per-test boundary generation and CRLF joins are wasted.
+_upload_request = httpx.Request(
+    "POST",
+    "http://test/upload",
+    data={"user_id": TEST_USER_ID, "tags": "tag1,tag2"},
+    files=UPLOAD_FILES,
+)
+UPLOAD_BODY = _upload_request.read()
+UPLOAD_HEADERS = {"content-type": _upload_request.headers["content-type"]}
+
+async def _upload(client):
+    response = await client.post("/upload", content=UPLOAD_BODY, headers=UPLOAD_HEADERS)
+    assert response.status_code == 200
+    # Known schema, so parse the raw bytes with orjson instead of the
+    # slower stdlib decode behind response.json().
+    return orjson.loads(response.content)["id"]
+
+@pytest_asyncio.fixture(scope="module")
+async def module_storage(tmp_path_factory):
+    """Storage shared by the read-only tests below, so they reuse one upload."""
+    storage = Storage(base_path=str(tmp_path_factory.mktemp("shared-audio")), db_path=":memory:")
+    yield storage
+    await storage.cleanup()
+
+@pytest_asyncio.fixture(scope="module")
+async def _uploaded_file_id(client, module_storage):
+    app.dependency_overrides[get_storage] = lambda: module_storage
+    try:
+        return await _upload(client)
+    finally:
+        app.dependency_overrides.pop(get_storage, None)
+
+@pytest.fixture
+def uploaded_file(module_storage, _uploaded_file_id):
+    """File id of the shared upload, with the shared storage active."""
+    app.dependency_overrides[get_storage] = lambda: module_storage
+    yield _uploaded_file_id
+    app.dependency_overrides.pop(get_storage, None)
+
+async def test_list_with_uploads(client, uploaded_file):
+    response = await client.get(LIST_URL)
+    assert response.status_code == 200
+    assert orjson.loads(response.content)["count"] == 1
+
+async def test_list_with_tag_filter(client, uploaded_file):
+    tagged = await client.get(LIST_URL.copy_merge_params({"tag": "tag1"}))
+    assert orjson.loads(tagged.content)["count"] == 1
+    untagged = await client.get(LIST_URL.copy_merge_params({"tag": "jazz"}))
+    assert orjson.loads(untagged.content)["count"] == 0
+
+async def test_get_file_info(client, uploaded_file):
+    response = await client.get(_file_url(uploaded_file, "/info"))
+    assert response.status_code == 200
+    info = response.json()
+    assert info["filename"] == "test.mp3"
+    assert info["file_size"] == len(TEST_AUDIO_CONTENT)
+
+async def test_download_individual_file(client, uploaded_file):
+    response = await client.get(_file_url(uploaded_file))
+    assert response.status_code == 200
+    assert response.content == TEST_AUDIO_CONTENT
+
+async def test_download_accel_redirect(client, uploaded_file, monkeypatch):
+    monkeypatch.setattr(app_main, "ACCEL_REDIRECT_PREFIX", "/internal/uploads")
+    response = await client.get(_file_url(uploaded_file))
+    assert response.status_code == 200
+    assert response.content == b""
+    accel = response.headers.get("x-accel-redirect")
+    assert accel == f"/internal/uploads/test_user/{uploaded_file}.mp3"
+
+async def test_download_with_files(client, uploaded_file):
+    response = await client.get(DOWNLOAD_URL)
+    assert response.status_code == 200
+    # Bind the header once; Headers lookups walk the raw header list.
+    content_type = response.headers.get("content-type")
+    assert content_type == "application/zip"
+
+async def test_upload_streams_large_file(client, temp_storage):
+    # Spans multiple storage chunks, exercising the streamed copy path.
+    content = b"x" * (2 * 1024 * 1024 + 123)
+    files = {"audio": ("big.mp3", io.BytesIO(content), "audio/mpeg")}
+    response = await client.post("/upload", data=USER_PARAMS, files=files)
+    assert response.status_code == 200
+    file_id = response.json()["id"]
+    info = await client.get(_file_url(file_id, "/info"))
+    assert info.json()["file_size"] == len(content)
+
+async def test_delete_file(client, temp_storage):
+    # Keeps its own storage since it mutates state.
+    file_id = await _upload(client)
+    file_url = _file_url(file_id)
+    response = await client.delete(file_url)
+    assert response.status_code == 200
+    assert response.json()["status"] == "deleted"
+    response = await client.get(file_url)
+    assert response.status_code == 404